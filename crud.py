@@ -1,68 +1,95 @@
 from models import Finance, User, Budget
 from schemas import FinanceCreate, UserCreate, BudgetCreate
-from sqlalchemy.orm import Session
-from sqlalchemy import func, extract
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, extract, update as sql_update
 from datetime import date
 import calendar
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _month_bounds(year: int, month: int):
+    # Half-open [start, end) range so the (user_id, date) index can be used.
+    start = date(year, month, 1)
+    end = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return start, end
 
-def get_user_by_username(db: Session, username: str):
-    return db.query(User).filter(User.username == username).first()
+async def get_user_by_username(db: AsyncSession, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
 
-def create_user(db: Session, user: UserCreate):
-    hashed_password = pwd_context.hash(user.password)
+async def get_login_row(db: AsyncSession, username: str):
+    # Only the columns login needs, without building an ORM instance.
+    result = await db.execute(
+        select(User.id, User.username, User.hashed_password).where(User.username == username)
+    )
+    return result.first()
+
+async def set_user_password(db: AsyncSession, user_id: int, hashed_password: str):
+    await db.execute(sql_update(User).where(User.id == user_id).values(hashed_password=hashed_password))
+    await db.commit()
+
+async def create_user(db: AsyncSession, user: UserCreate, hashed_password: str):
     db_user = User(username=user.username, email=user.email, hashed_password=hashed_password)
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
-def create(db: Session, data: FinanceCreate, user_id: int):
+async def create(db: AsyncSession, data: FinanceCreate, user_id: int):
     finance = Finance(**data.model_dump(), user_id=user_id)
     db.add(finance)
-    db.commit()
-    db.refresh(finance)
+    await db.commit()
+    await db.refresh(finance)
     return finance
 
-def get(db: Session, user_id: int, category: str | None = None):
-    query = db.query(Finance).filter(Finance.user_id == user_id)
+def _ledger_query(user_id: int, category: str | None = None):
+    query = select(Finance).where(Finance.user_id == user_id)
     if category:
-        query = query.filter(Finance.category == category)
-    return query.all()
+        query = query.where(Finance.category == category)
+    return query.order_by(Finance.id)
+
+async def get(db: AsyncSession, user_id: int, category: str | None = None, limit: int = 100, after_id: int | None = None):
+    # Keyset pagination on (user_id, id) so deep pages stay cheap.
+    query = _ledger_query(user_id, category)
+    if after_id is not None:
+        query = query.where(Finance.id > after_id)
+    result = await db.execute(query.limit(limit))
+    return result.scalars().all()
+
+async def stream(db: AsyncSession, user_id: int, category: str | None = None):
+    result = await db.stream_scalars(_ledger_query(user_id, category).execution_options(yield_per=500))
+    async for finance in result:
+        yield finance
 
-def update(db: Session, id: int, data: FinanceCreate, user_id: int):
-    finance = db.query(Finance).filter(Finance.id == id, Finance.user_id == user_id).first()
+async def update(db: AsyncSession, id: int, data: FinanceCreate, user_id: int):
+    result = await db.execute(select(Finance).where(Finance.id == id, Finance.user_id == user_id))
+    finance = result.scalars().first()
     if finance:
         for key, value in data.model_dump().items():
             setattr(finance, key, value)
-        db.commit()
-        db.refresh(finance)
+        await db.commit()
+        await db.refresh(finance)
     return finance
 
-def delete(db: Session, id: int, user_id: int):
-    finance = db.query(Finance).filter(Finance.id == id, Finance.user_id == user_id).first()
+async def delete(db: AsyncSession, id: int, user_id: int):
+    result = await db.execute(select(Finance).where(Finance.id == id, Finance.user_id == user_id))
+    finance = result.scalars().first()
     if finance:
-        db.delete(finance)
-        db.commit()
+        await db.delete(finance)
+        await db.commit()
         return True
     return False
 
-def get_monthly_summary(db: Session, month: int, year: int, user_id: int):
-    # Calculate start and end date of the month
-    _, last_day = calendar.monthrange(year, month)
-    start_date = date(year, month, 1)
-    end_date = date(year, month, last_day)
+async def get_monthly_summary(db: AsyncSession, month: int, year: int, user_id: int):
+    start_date, end_date = _month_bounds(year, month)
     
-    transactions = db.query(Finance).filter(
+    result = await db.execute(select(
+        func.coalesce(func.sum(Finance.salary), 0),
+        func.coalesce(func.sum(Finance.expenses), 0)
+    ).where(
         Finance.user_id == user_id,
         Finance.date >= start_date,
-        Finance.date <= end_date
-    ).all()
-    
-    income = sum(t.salary for t in transactions)
-    expenses = sum(t.expenses for t in transactions)
+        Finance.date < end_date
+    ))
+    income, expenses = result.one()
     
     return {
         "month": month,
@@ -72,65 +99,65 @@ def get_monthly_summary(db: Session, month: int, year: int, user_id: int):
         "balance": income - expenses
     }
 
-def get_category_expenses(db: Session, month: int, year: int, user_id: int):
-    # Calculate start and end date of the month
-    _, last_day = calendar.monthrange(year, month)
-    start_date = date(year, month, 1)
-    end_date = date(year, month, last_day)
+async def get_category_expenses(db: AsyncSession, month: int, year: int, user_id: int):
+    start_date, end_date = _month_bounds(year, month)
     
-    results = db.query(
+    result = await db.execute(select(
         Finance.category,
         func.sum(Finance.expenses).label('total')
-    ).filter(
+    ).where(
         Finance.user_id == user_id,
         Finance.date >= start_date,
-        Finance.date <= end_date,
+        Finance.date < end_date,
         Finance.expenses > 0
-    ).group_by(Finance.category).all()
+    ).group_by(Finance.category))
+    results = result.all()
     
     return [{"category": r[0], "amount": r[1]} for r in results]
 
-def create_budget(db: Session, budget: BudgetCreate, user_id: int):
+async def create_budget(db: AsyncSession, budget: BudgetCreate, user_id: int):
     # Check if budget exists for this month/year
-    existing = db.query(Budget).filter(
+    result = await db.execute(select(Budget).where(
         Budget.user_id == user_id,
         Budget.month == budget.month,
         Budget.year == budget.year
-    ).first()
+    ))
+    existing = result.scalars().first()
     
     if existing:
         existing.amount = budget.amount
-        db.commit()
-        db.refresh(existing)
+        await db.commit()
+        await db.refresh(existing)
         return existing
     
     db_budget = Budget(**budget.model_dump(), user_id=user_id)
     db.add(db_budget)
-    db.commit()
-    db.refresh(db_budget)
+    await db.commit()
+    await db.refresh(db_budget)
     return db_budget
 
-def get_budget(db: Session, month: int, year: int, user_id: int):
-    return db.query(Budget).filter(
+async def get_budget(db: AsyncSession, month: int, year: int, user_id: int):
+    result = await db.execute(select(Budget).where(
         Budget.user_id == user_id,
         Budget.month == month,
         Budget.year == year
-    ).first()
+    ))
+    return result.scalars().first()
 
-def get_daily_spending(db: Session, month: int, year: int, user_id: int):
+async def get_daily_spending(db: AsyncSession, month: int, year: int, user_id: int):
     _, last_day = calendar.monthrange(year, month)
-    start_date = date(year, month, 1)
-    end_date = date(year, month, last_day)
+    start_date, end_date = _month_bounds(year, month)
     
-    results = db.query(
+    result = await db.execute(select(
         Finance.date,
         func.sum(Finance.expenses).label('total')
-    ).filter(
+    ).where(
         Finance.user_id == user_id,
         Finance.date >= start_date,
-        Finance.date <= end_date,
+        Finance.date < end_date,
         Finance.expenses > 0
-    ).group_by(Finance.date).all()
+    ).group_by(Finance.date))
+    results = result.all()
     
     # Fill in missing days with 0
     daily_data = {}
@@ -147,15 +174,18 @@ def get_daily_spending(db: Session, month: int, year: int, user_id: int):
         
     return final_data
 
-def get_yearly_expenses(db: Session, year: int, user_id: int):
-    results = db.query(
-        extract('month', Finance.date).label('month'),
+async def get_yearly_expenses(db: AsyncSession, year: int, user_id: int):
+    month_col = extract('month', Finance.date).label('month')
+    result = await db.execute(select(
+        month_col,
         func.sum(Finance.expenses).label('total')
-    ).filter(
+    ).where(
         Finance.user_id == user_id,
-        extract('year', Finance.date) == year,
+        Finance.date >= date(year, 1, 1),
+        Finance.date < date(year + 1, 1, 1),
         Finance.expenses > 0
-    ).group_by('month').all()
+    ).group_by(month_col))
+    results = result.all()
     
     monthly_data = {r[0]: r[1] for r in results}
     
@@ -166,4 +196,4 @@ def get_yearly_expenses(db: Session, year: int, user_id: int):
             "amount": monthly_data.get(month, 0)
         })
         
-    return final_data
\ No newline at end of file
+    return final_data
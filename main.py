@@ -1,53 +1,146 @@
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, Depends, HTTPException, Query, status, Request
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from database import engine, SessionLocal
 from models import Base, User, Budget, Finance
 from schemas import FinanceCreate, FinanceResponse, UserCreate, UserResponse, BudgetCreate, BudgetResponse
 import crud
-from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from sqlalchemy.ext.asyncio import AsyncSession
+from security import pwd_context, hash_password, verify_password, shutdown_pool
 from datetime import datetime, timedelta
-from jose import jwt, JWTError
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey, Ed25519PublicKey
 import os
+import hashlib
+import threading
+import time
+from cachetools import TTLCache
+from slowapi import Limiter, _rate_limit_exceeded_handler
+from slowapi.errors import RateLimitExceeded
+from slowapi.util import get_remote_address
+import orjson
 
-Base.metadata.create_all(bind=engine)
 app = FastAPI()
 
+# Password hashing is deliberately expensive; cap auth calls per client IP.
+# 10 per 2s allows a burst of 10 at a sustained 5/s. The default memory://
+# storage counts per process, so N workers allow N times that; point
+# RATE_LIMIT_STORAGE_URI at e.g. redis:// to share one budget. Behind a
+# proxy the client IP is only right if FORWARDED_ALLOW_IPS trusts it.
+AUTH_RATE_LIMIT = "10/2seconds"
+limiter = Limiter(key_func=get_remote_address, storage_uri=os.getenv("RATE_LIMIT_STORAGE_URI", "memory://"))
+app.state.limiter = limiter
+app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
 @app.on_event("startup")
 async def startup_event():
+    # Schema creation is opt-in so regular starts don't pay for it.
+    if os.getenv("RUN_MIGRATIONS"):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
     print("\n\n==================================================")
     print(" LEDGER-X SERVER STARTED SUCCESSFULLY ")
     print("==================================================\n\n")
 
-SECRET_KEY = "your_secret_key_change_me_in_production"
-ALGORITHM = "HS256"
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_pool()
+    await engine.dispose()
+
+# With an Ed25519 key (openssl genpkey -algorithm ed25519) tokens are signed
+# with EdDSA and extra nodes only need the public key to verify them.
+# Keys are parsed once here rather than on every encode/decode.
+JWT_PRIVATE_KEY_FILE = os.getenv("JWT_PRIVATE_KEY_FILE")
+JWT_PUBLIC_KEY_FILE = os.getenv("JWT_PUBLIC_KEY_FILE")
+if JWT_PRIVATE_KEY_FILE or JWT_PUBLIC_KEY_FILE:
+    ALGORITHM = "EdDSA"
+    SIGNING_KEY = None
+    if JWT_PRIVATE_KEY_FILE:
+        with open(JWT_PRIVATE_KEY_FILE, "rb") as f:
+            SIGNING_KEY = serialization.load_pem_private_key(f.read(), password=None)
+        if not isinstance(SIGNING_KEY, Ed25519PrivateKey):
+            raise ValueError("JWT_PRIVATE_KEY_FILE must contain an Ed25519 private key")
+    if JWT_PUBLIC_KEY_FILE:
+        with open(JWT_PUBLIC_KEY_FILE, "rb") as f:
+            VERIFY_KEY = serialization.load_pem_public_key(f.read())
+        if not isinstance(VERIFY_KEY, Ed25519PublicKey):
+            raise ValueError("JWT_PUBLIC_KEY_FILE must contain an Ed25519 public key")
+        raw = (serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+        if SIGNING_KEY is not None and SIGNING_KEY.public_key().public_bytes(*raw) != VERIFY_KEY.public_bytes(*raw):
+            raise ValueError("JWT_PUBLIC_KEY_FILE does not match JWT_PRIVATE_KEY_FILE")
+    else:
+        VERIFY_KEY = SIGNING_KEY.public_key()
+else:
+    ALGORITHM = "HS256"
+    SECRET_KEY = os.getenv("SECRET_KEY")
+    if not SECRET_KEY:
+        raise ValueError("SECRET_KEY environment variable is not set")
+    SIGNING_KEY = VERIFY_KEY = SECRET_KEY.encode()
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+
+# Comma-separated list, e.g. CORS_ORIGINS=http://127.0.0.1:5502,http://localhost:5502
+origins = [o.strip() for o in os.getenv("CORS_ORIGINS", "").split(",") if o.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["authorization", "content-type"],
+    max_age=86400,
 )
 
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.add_middleware(GZipMiddleware, minimum_size=500)
+
+# Behind nginx/Caddy the proxy serves /static/ straight from disk
+# (e.g. location /static/ { alias /app/static/; expires 7d; }).
+if not os.getenv("BEHIND_PROXY"):
+    app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+def _etag_for(body: bytes) -> str:
+    return f'"{hashlib.md5(body).hexdigest()}"'
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    # Weak comparison (RFC 9110): proxies such as nginx add W/ when they
+    # re-compress, and clients may send several tags or "*".
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+def _conditional_response(request: Request, body: bytes, etag: str, media_type: str, cache_control: str) -> Response:
+    # Built per request: middleware edits response headers in place.
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=media_type, headers=headers)
+
+# Neither page uses request data, so render them once and reuse the bytes.
+def _render_page(name: str) -> tuple[bytes, str]:
+    body = templates.get_template(name).render({"request": None}).encode()
+    return body, _etag_for(body)
+
+def _page_response(request: Request, body: bytes, etag: str) -> Response:
+    return _conditional_response(request, body, etag, "text/html", "public, max-age=300")
+
+_login_html, _login_etag = _render_page("login.html")
+_dashboard_html, _dashboard_etag = _render_page("dashboard.html")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -56,43 +149,121 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = jwt.encode(to_encode, SIGNING_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+# Decoded tokens -> (exp, user), keyed by a digest so raw tokens are never stored.
+_token_cache = TTLCache(maxsize=10_000, ttl=30)
+_token_cache_lock = threading.Lock()
+
+def _token_key(token: str) -> bytes:
+    return hashlib.sha256(token.encode()).digest()[:16]
+
+def invalidate_user_tokens(user_id: int):
+    with _token_cache_lock:
+        for key in [k for k, (_, u) in _token_cache.items() if u.id == user_id]:
+            _token_cache.pop(key, None)
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    key = _token_key(token)
+    with _token_cache_lock:
+        cached = _token_cache.get(key)
+    if cached is not None:
+        exp, user = cached
+        if exp > time.time():
+            return user
+        with _token_cache_lock:
+            _token_cache.pop(key, None)
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, VERIFY_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]})
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
-    except JWTError:
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token has expired",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    except jwt.InvalidTokenError:
         raise credentials_exception
-    user = crud.get_user_by_username(db, username=username)
+    user = await crud.get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
+    # Detach so a later commit in this session can't expire the cached copy.
+    db.expunge(user)
+    exp = payload.get("exp")
+    if exp is not None:
+        with _token_cache_lock:
+            _token_cache[key] = (exp, user)
     return user
 
+# Dashboard aggregates keyed by (user_id, generation, query). A ledger write
+# bumps the user's generation, so older entries, including any computed
+# while the write was in flight, are never read again and simply age out.
+# Invalidation only reaches the process that handled the write, so with
+# several uvicorn workers another worker can serve pre-write totals until
+# its entry expires; the default TTL is kept short in that case.
+_summary_cache_ttl = float(
+    os.getenv("SUMMARY_CACHE_TTL")
+    or (60 if int(os.getenv("WEB_CONCURRENCY", "1")) <= 1 else 2)
+)
+_summary_cache = TTLCache(maxsize=20_000, ttl=_summary_cache_ttl)
+_summary_generations: dict[int, int] = {}
+_summary_cache_lock = threading.Lock()
+
+async def _cached_summary(user_id: int, key: tuple, compute):
+    with _summary_cache_lock:
+        generation = _summary_generations.get(user_id, 0)
+        value = _summary_cache.get((user_id, generation, key))
+    if value is not None:
+        return value
+    value = await compute()
+    with _summary_cache_lock:
+        if _summary_generations.get(user_id, 0) == generation:
+            _summary_cache[(user_id, generation, key)] = value
+    return value
+
+def _etag_response(request: Request, payload) -> Response:
+    # no-cache rather than max-age so the browser revalidates on every
+    # fetch; the body is only as fresh as the summary cache above.
+    body = orjson.dumps(payload)
+    return _conditional_response(request, body, _etag_for(body), "application/json", "private, no-cache")
+
+def invalidate_user_summaries(user_id: int):
+    with _summary_cache_lock:
+        _summary_generations[user_id] = _summary_generations.get(user_id, 0) + 1
+
 @app.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_username(db, username=user.username)
+@limiter.limit(AUTH_RATE_LIMIT)
+async def register(request: Request, user: UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await crud.get_user_by_username(db, username=user.username)
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
-    return crud.create_user(db=db, user=user)
+    hashed_password = await hash_password(user.password)
+    return await crud.create_user(db=db, user=user, hashed_password=hashed_password)
 
 @app.post("/token")
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = crud.get_user_by_username(db, form_data.username)
-    if not user or not pwd_context.verify(form_data.password, user.hashed_password):
+@limiter.limit(AUTH_RATE_LIMIT)
+async def login(request: Request, form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    # Verify-only nodes (public key only) refuse before any hashing or writes.
+    if SIGNING_KEY is None:
+        raise HTTPException(status_code=503, detail="This server cannot issue tokens")
+    user = await crud.get_login_row(db, form_data.username)
+    if not user or not await verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if pwd_context.needs_update(user.hashed_password):
+        await crud.set_user_password(db, user.id, await hash_password(form_data.password))
+        invalidate_user_tokens(user.id)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -100,68 +271,108 @@ def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depend
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/", response_class=HTMLResponse)
-def read_root(request: Request):
-    return templates.TemplateResponse("login.html", {"request": request})
+async def read_root(request: Request):
+    return _page_response(request, _login_html, _login_etag)
 
 @app.get("/dashboard", response_class=HTMLResponse)
-def dashboard(request: Request):
-    return templates.TemplateResponse("dashboard.html", {"request": request})
+async def dashboard(request: Request):
+    return _page_response(request, _dashboard_html, _dashboard_etag)
 
 @app.post("/ledger/", response_model=FinanceResponse)
-def create(data: FinanceCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.create(db, data, user_id=current_user.id)
+async def create(data: FinanceCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    finance = await crud.create(db, data, user_id=current_user.id)
+    invalidate_user_summaries(current_user.id)
+    return finance
 
 @app.get("/ledger/", response_model=list[FinanceResponse])
-def get(category: str | None = None, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.get(db, user_id=current_user.id, category=category)
+async def get(category: str | None = None, limit: int = Query(100, ge=1, le=500), after_id: int | None = None, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await crud.get(db, user_id=current_user.id, category=category, limit=limit, after_id=after_id)
+
+@app.get("/ledger/export")
+async def export_ledger(category: str | None = None, current_user: User = Depends(get_current_user)):
+    user_id = current_user.id
+
+    # Own session: the stream outlives the request's get_db dependency.
+    async def rows():
+        async with SessionLocal() as db:
+            async for finance in crud.stream(db, user_id=user_id, category=category):
+                yield orjson.dumps(FinanceResponse.model_validate(finance).model_dump()) + b"\n"
+
+    return StreamingResponse(rows(), media_type="application/x-ndjson")
 
 @app.put("/ledger/{id}", response_model=FinanceResponse)
-def update(id: int, data: FinanceCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    updated = crud.update(db, id, data, user_id=current_user.id)
+async def update(id: int, data: FinanceCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    updated = await crud.update(db, id, data, user_id=current_user.id)
     if not updated:
         raise HTTPException(status_code=404, detail="Record not found")
+    invalidate_user_summaries(current_user.id)
     return updated
 
 @app.delete("/ledger/{id}")
-def delete(id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    deleted = crud.delete(db, id, user_id=current_user.id)
+async def delete(id: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    deleted = await crud.delete(db, id, user_id=current_user.id)
     if not deleted:
         raise HTTPException(status_code=404, detail="Record not found")
+    invalidate_user_summaries(current_user.id)
     return {"message": "Record deleted successfully"}
 
 @app.get("/api/users/me", response_model=UserResponse)
-def read_users_me(current_user: User = Depends(get_current_user)):
+async def read_users_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 @app.get("/api/summary")
-def get_monthly_summary(month: int, year: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.get_monthly_summary(db, month, year, user_id=current_user.id)
+async def get_monthly_summary(request: Request, month: int, year: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    payload = await _cached_summary(
+        current_user.id, ("summary", month, year),
+        lambda: crud.get_monthly_summary(db, month, year, user_id=current_user.id),
+    )
+    return _etag_response(request, payload)
 
 @app.get("/api/category-expenses")
-def get_category_expenses(month: int, year: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.get_category_expenses(db, month, year, user_id=current_user.id)
+async def get_category_expenses(request: Request, month: int, year: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    payload = await _cached_summary(
+        current_user.id, ("category", month, year),
+        lambda: crud.get_category_expenses(db, month, year, user_id=current_user.id),
+    )
+    return _etag_response(request, payload)
 
 @app.post("/api/budget", response_model=BudgetResponse)
-def create_budget(budget: BudgetCreate, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.create_budget(db, budget, user_id=current_user.id)
+async def create_budget(budget: BudgetCreate, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await crud.create_budget(db, budget, user_id=current_user.id)
 
 @app.get("/api/budget", response_model=BudgetResponse | None)
-def get_budget(month: int, year: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.get_budget(db, month, year, user_id=current_user.id)
+async def get_budget(month: int, year: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    return await crud.get_budget(db, month, year, user_id=current_user.id)
 
 @app.get("/api/daily-spending")
-def get_daily_spending(month: int, year: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.get_daily_spending(db, month, year, user_id=current_user.id)
+async def get_daily_spending(request: Request, month: int, year: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    payload = await _cached_summary(
+        current_user.id, ("daily", month, year),
+        lambda: crud.get_daily_spending(db, month, year, user_id=current_user.id),
+    )
+    return _etag_response(request, payload)
 
 @app.get("/api/yearly-expenses")
-def get_yearly_expenses(year: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
-    return crud.get_yearly_expenses(db, year, user_id=current_user.id)
-
-# TEMPORARY: Admin endpoint to reset DB in production
-@app.get("/api/admin/reset-db-force")
-def reset_database_force():
-    # Drop all tables
-    Base.metadata.drop_all(bind=engine)
-    # Recreate all tables
-    Base.metadata.create_all(bind=engine)
-    return {"message": "Database has been reset successfully. All data deleted. New schema applied."}
+async def get_yearly_expenses(request: Request, year: int, db: AsyncSession = Depends(get_db), current_user: User = Depends(get_current_user)):
+    payload = await _cached_summary(
+        current_user.id, ("yearly", year),
+        lambda: crud.get_yearly_expenses(db, year, user_id=current_user.id),
+    )
+    return _etag_response(request, payload)
+
+if __name__ == "__main__":
+    import sys
+    import uvicorn
+
+    # Equivalent CLI: uvicorn main:app --loop uvloop --http httptools --backlog 2048 --proxy-headers
+    # Worker count comes from WEB_CONCURRENCY. uvloop is not available on Windows.
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "127.0.0.1"),
+        port=int(os.getenv("PORT", "8000")),
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        backlog=2048,
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    )
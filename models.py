@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, String, Float, Date, ForeignKey
+from sqlalchemy import Integer, String, Float, Date, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column
 from database import Base
 import datetime
@@ -15,6 +15,12 @@ class Finance(Base):
     date: Mapped[datetime.date] = mapped_column(Date)
     user_id: Mapped[int] = mapped_column(Integer, ForeignKey("users.id"))
 
+    __table_args__ = (
+        Index("ix_finance_user_id_id", "user_id", "id"),
+        Index("ix_finance_user_date", "user_id", "date"),
+        Index("ix_finance_user_cat_date", "user_id", "category", "date"),
+    )
+
 class User(Base):
     __tablename__ = "users"
 
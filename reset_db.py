@@ -1,28 +1,31 @@
+import asyncio
 from database import engine, Base
 from models import User, Finance, Budget
 from sqlalchemy import text
 
-def reset_database():
+async def reset_database():
     print("Resetting database...")
     try:
         # Create a connection to drop tables
-        with engine.connect() as connection:
+        async with engine.begin() as connection:
             # Drop tables in correct order (dependencies first)
             print("Dropping tables...")
             # We use cascade to ensure dependent rows/constraints are removed
-            connection.execute(text("DROP TABLE IF EXISTS budgets CASCADE"))
-            connection.execute(text("DROP TABLE IF EXISTS finance CASCADE"))
-            connection.execute(text("DROP TABLE IF EXISTS users CASCADE"))
-            connection.commit()
+            await connection.execute(text("DROP TABLE IF EXISTS budgets CASCADE"))
+            await connection.execute(text("DROP TABLE IF EXISTS finance CASCADE"))
+            await connection.execute(text("DROP TABLE IF EXISTS users CASCADE"))
             print("Tables dropped.")
 
         # Recreate tables
         print("Creating new tables...")
-        Base.metadata.create_all(bind=engine)
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
         print("Database reset successful! New schema with user_id is ready.")
         
     except Exception as e:
         print(f"Error resetting database: {e}")
+    finally:
+        await engine.dispose()
 
 if __name__ == "__main__":
-    reset_database()
+    asyncio.run(reset_database())
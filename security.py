@@ -0,0 +1,46 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+# argon2id for new hashes; existing bcrypt hashes still verify and are
+# flagged by needs_update() so login can migrate them.
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__memory_cost=19456,
+    argon2__time_cost=2,
+    argon2__parallelism=1,
+)
+
+# Hashing is CPU-bound, so run it in worker processes instead of the
+# threadpool to keep it off the GIL shared with the rest of the app.
+# Workers are spawned, not forked, since the server process already has a
+# running loop, DB sockets and threads. Each uvicorn worker gets its own
+# pool, so split the cores between them unless PASSWORD_HASH_WORKERS is set.
+_pw_workers = int(
+    os.getenv("PASSWORD_HASH_WORKERS")
+    or max(1, (os.cpu_count() or 1) // int(os.getenv("WEB_CONCURRENCY", "1")))
+)
+_pw_pool = ProcessPoolExecutor(max_workers=_pw_workers, mp_context=multiprocessing.get_context("spawn"))
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verify(password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(password, hashed_password)
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pw_pool, _hash, password)
+
+async def verify_password(password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_pw_pool, _verify, password, hashed_password)
+
+def shutdown_pool():
+    _pw_pool.shutdown(wait=False, cancel_futures=True)
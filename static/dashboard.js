@@ -271,10 +271,23 @@ async function saveTransaction(e) {
 
 async function loadHistory() {
     try {
-        const res = await fetch(`${API_BASE}/ledger/`, {
-            headers: { 'Authorization': `Bearer ${token}` }
-        });
-        const data = await res.json();
+        // The API pages results; walk the pages until a short one comes back
+        const pageSize = 500;
+        let data = [];
+        let afterId = null;
+        while (true) {
+            const query = afterId === null ? `limit=${pageSize}` : `limit=${pageSize}&after_id=${afterId}`;
+            const res = await fetch(`${API_BASE}/ledger/?${query}`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            const page = await res.json();
+            if (!res.ok || !Array.isArray(page)) {
+                throw new Error(page.detail || 'Failed to fetch history');
+            }
+            data = data.concat(page);
+            if (page.length < pageSize) break;
+            afterId = page[page.length - 1].id;
+        }
 
         const tbody = document.getElementById('transactionsTable');
         tbody.innerHTML = '';